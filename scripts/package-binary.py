@@ -25,14 +25,23 @@ Usage:
 
 import argparse
 import hashlib
+import io
 import json
 import os
 import subprocess
 import sys
 import tarfile
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+# uquery --json output covers every requested target; orjson parses it
+# several times faster than the stdlib when it is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def run_command(cmd: List[str], capture: bool = True) -> subprocess.CompletedProcess:
     """Run a command and return the result."""
@@ -42,6 +51,62 @@ def run_command(cmd: List[str], capture: bool = True) -> subprocess.CompletedPro
         return subprocess.run(cmd, check=True)
 
 
+def _label_key(target: str) -> str:
+    """Normalize a target label to //pkg:name.
+
+    Drops any cell prefix (buckos//pkg:name) and adds the // that a
+    bare pkg:name was given without, so query output and command-line
+    targets map to the same key.
+    """
+    return "//" + target.split("//", 1)[-1]
+
+
+def _parse_query_json(stdout: str) -> Dict:
+    """Parse buck2 query --json output, keyed by normalized label."""
+    # Buck2 may output logging lines before JSON, find the JSON part
+    json_start = stdout.find('{')
+    if json_start == -1:
+        return {}
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers
+    # catch the same exception either way.
+    loads = orjson.loads if orjson is not None else json.loads
+    info = loads(stdout[json_start:])
+    return {_label_key(label): attrs for label, attrs in info.items()}
+
+
+# uquery attributes per target, keyed by _label_key.  Shared by
+# get_target_info and calculate_config_hash, and filled for every target
+# at once by main() so a multi-target run makes one uquery call in total.
+_UQUERY_CACHE: Dict[str, Dict] = {}
+_UQUERY_ATTRS = ("name", "version", "env", "use_flags")
+
+
+def uquery_target_attrs(targets: List[str]) -> Dict[str, Dict]:
+    """Get unconfigured attributes for Buck targets.
+
+    Targets not already cached are queried together in a single
+    ``buck2 uquery "set(...)"`` invocation that asks for every attribute
+    this script uses.
+
+    Args:
+        targets: Buck target paths
+
+    Returns:
+        Dict mapping each normalized target label to its attributes
+    """
+    missing = [t for t in targets if _label_key(t) not in _UQUERY_CACHE]
+    if missing:
+        cmd = ["buck2", "uquery", "set({})".format(" ".join(missing))]
+        for attr in _UQUERY_ATTRS:
+            cmd += ["--output-attribute", attr]
+        cmd.append("--json")
+        result = run_command(cmd)
+        _UQUERY_CACHE.update(_parse_query_json(result.stdout))
+        for target in missing:
+            _UQUERY_CACHE.setdefault(_label_key(target), {})
+    return {_label_key(t): _UQUERY_CACHE[_label_key(t)] for t in targets}
+
+
 def get_target_info(target: str, skip_build: bool = False) -> Dict:
     """Get information about a Buck target.
 
@@ -54,35 +119,22 @@ def get_target_info(target: str, skip_build: bool = False) -> Dict:
     """
     print(f"Getting info for {target}...")
 
-    if skip_build:
-        # Use uquery to avoid configured target analysis
-        query_cmd = "uquery"
-    else:
-        query_cmd = "query"
-
     try:
-        # Query target attributes
-        result = run_command([
-            "buck2", query_cmd,
-            f"{target}",
-            "--output-attribute", "name",
-            "--output-attribute", "version",
-            "--json"
-        ])
-
-        # Buck2 may output logging lines before JSON, find the JSON part
-        stdout = result.stdout
-        json_start = stdout.find('{')
-        if json_start != -1:
-            stdout = stdout[json_start:]
-
-        info = json.loads(stdout)
-        # Extract from JSON structure - target may have "buckos//" prefix
-        target_key = target
-        if target not in info and f"buckos//{target.lstrip('//')}" in info:
-            target_key = f"buckos//{target.lstrip('//')}"
-
-        target_data = info.get(target_key, {})
+        if skip_build:
+            # Use uquery to avoid configured target analysis
+            target_data = uquery_target_attrs([target])[_label_key(target)]
+        else:
+            # Query target attributes
+            result = run_command([
+                "buck2", "query",
+                f"{target}",
+                "--output-attribute", "name",
+                "--output-attribute", "version",
+                "--json"
+            ])
+            info = _parse_query_json(result.stdout)
+            target_data = info.get(_label_key(target), {})
+
         return {
             "target": target,
             "name": target_data.get("name", target.split(":")[-1]),
@@ -168,28 +220,10 @@ def calculate_config_hash(target: str, skip_build: bool = False) -> str:
     # Get target-specific env variables and USE flags
     # Use uquery to avoid triggering builds
     try:
-        env_result = run_command([
-            "buck2", "uquery",
-            f"{target}",
-            "--output-attribute", "env",
-            "--output-attribute", "use_flags",
-            "--json"
-        ])
-
-        # Parse JSON to extract env and use_flags
-        stdout = env_result.stdout
-        json_start = stdout.find('{')
-        if json_start != -1:
-            stdout = stdout[json_start:]
-            env_data = json.loads(stdout)
-
-            # Find the target in the result
-            target_key = target
-            if target not in env_data and f"buckos//{target.lstrip('//')}" in env_data:
-                target_key = f"buckos//{target.lstrip('//')}"
-
+        target_data = uquery_target_attrs([target])[_label_key(target)]
+        if target_data:
             # Get env attribute - include ALL env variables in sorted order
-            env_attr = env_data.get(target_key, {}).get("env", {})
+            env_attr = target_data.get("env", {})
             if env_attr:
                 # Sort keys for consistent hashing
                 for key in sorted(env_attr.keys()):
@@ -198,7 +232,7 @@ def calculate_config_hash(target: str, skip_build: bool = False) -> str:
                     config_parts.append(f"env.{key}:{value}")
 
             # Get use_flags attribute
-            use_flags = env_data.get(target_key, {}).get("use_flags", [])
+            use_flags = target_data.get("use_flags", [])
             if use_flags:
                 config_parts.append(f"target_use:{','.join(sorted(use_flags))}")
     except Exception as e:
@@ -247,62 +281,101 @@ def find_built_package(target: str) -> Optional[Path]:
     if not buck_out.exists():
         return None
 
-    # For toolchains targets, search in toolchains/bootstrap directly
-    if target_path.startswith("toolchains/"):
-        # Pattern: buck-out/v2/gen/buckos/HASH/toolchains/bootstrap/__PACKAGE__/PACKAGE/
-        subpath = target_path
-
-        for hash_dir in buck_out.iterdir():
-            if not hash_dir.is_dir():
+    # Pattern: buck-out/v2/gen/buckos/HASH/<target_path>/__PACKAGE__/PACKAGE/
+    is_toolchain = target_path.startswith("toolchains/")
+    with os.scandir(buck_out) as it:
+        for hash_dir in it:
+            if not hash_dir.is_dir(follow_symlinks=False):
                 continue
 
-            pkg_dir = hash_dir / subpath / f"__{package_name}__" / package_name
-            if pkg_dir.exists() and pkg_dir.is_dir():
-                if (pkg_dir / "usr").exists() or len(list(pkg_dir.iterdir())) > 0:
-                    print(f"Found built package at: {pkg_dir}")
-                    return pkg_dir
-    else:
-        # Find all hash directories for regular packages
-        for hash_dir in buck_out.iterdir():
-            if not hash_dir.is_dir():
+            pkg_dir = Path(hash_dir.path) / target_path / f"__{package_name}__" / package_name
+            if not pkg_dir.is_dir():
                 continue
 
-            # Check for package directory
-            pkg_dir = hash_dir / target_path / f"__{package_name}__" / package_name
-            if pkg_dir.exists() and pkg_dir.is_dir():
-                # Verify it has actual content (usr/ directory)
-                if (pkg_dir / "usr").exists():
-                    print(f"Found built package at: {pkg_dir}")
-                    return pkg_dir
+            # Regular packages must have actual content (usr/ directory);
+            # toolchain outputs just need to be non-empty.
+            if (pkg_dir / "usr").exists():
+                found = True
+            elif is_toolchain:
+                with os.scandir(pkg_dir) as contents:
+                    found = next(contents, None) is not None
+            else:
+                found = False
+
+            if found:
+                print(f"Found built package at: {pkg_dir}")
+                return pkg_dir
 
     return None
 
 
+# Output paths of targets already built in this run, keyed by target.
+_BUILD_CACHE: Dict[str, Path] = {}
+
+
+def build_targets(targets: List[str]) -> None:
+    """Build several Buck targets in a single buck2 invocation.
+
+    One invocation pays buck2 client startup and graph loading once and
+    lets buck2 schedule the builds in parallel.  Output paths are stored
+    in _BUILD_CACHE for build_target to pick up.  If the batch fails,
+    nothing is cached and build_target builds each target on its own, so
+    errors are still reported per target.
+
+    Args:
+        targets: Buck target paths
+    """
+    print(f"Building {len(targets)} targets...")
+
+    result = subprocess.run(
+        ["buck2", "build", "--show-output", *targets],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        print("Warning: batch build failed, building targets individually")
+        return
+
+    # Each line is "target_name output_path"
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            _BUILD_CACHE[_label_key(parts[0])] = Path(parts[1])
+
+
 def build_target(target: str) -> Path:
     """Build a Buck target and return path to output.
 
+    Results are memoized per target for the lifetime of the process, so
+    a target named more than once only pays for one buck2 invocation.
+
     Args:
         target: Buck target path
 
     Returns:
         Path to built output
     """
-    print(f"Building {target}...")
+    cached = _BUILD_CACHE.get(_label_key(target))
+    if cached is not None and cached.exists():
+        return cached
 
-    # Build the target
-    run_command(["buck2", "build", target], capture=False)
+    print(f"Building {target}...")
 
-    # Get output path
-    result = run_command([
-        "buck2", "build", target,
-        "--show-output"
-    ])
+    # Build and report the output path in one invocation.  Only stdout
+    # is captured; buck2's progress on stderr still reaches the terminal.
+    result = subprocess.run(
+        ["buck2", "build", target, "--show-output"],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
 
     # Parse output path from "target_name output_path"
     output_line = result.stdout.strip().split('\n')[-1]
-    output_path = output_line.split()[-1]
+    output_path = Path(output_line.split()[-1])
 
-    return Path(output_path)
+    _BUILD_CACHE[_label_key(target)] = output_path
+    return output_path
 
 
 def calculate_file_hash(path: Path) -> str:
@@ -386,13 +459,13 @@ def create_package(
             "content_hash": file_hash,
         }
 
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            json.dump(metadata, f, indent=2)
-            metadata_path = f.name
-
-        tar.add(metadata_path, arcname="METADATA.json")
-        os.unlink(metadata_path)
+        # Add straight from memory; no temp file to create and clean up
+        metadata_bytes = json.dumps(metadata, indent=2).encode()
+        metadata_info = tarfile.TarInfo("METADATA.json")
+        metadata_info.size = len(metadata_bytes)
+        metadata_info.mtime = int(time.time())
+        metadata_info.mode = 0o644
+        tar.addfile(metadata_info, io.BytesIO(metadata_bytes))
 
     # Calculate SHA256 of the tarball
     sha256 = hashlib.sha256()
@@ -563,6 +636,16 @@ def main():
     print("=" * 60)
     print()
 
+    if len(args.targets) > 1:
+        try:
+            uquery_target_attrs(args.targets)
+        except (json.JSONDecodeError, subprocess.CalledProcessError) as e:
+            # Per-target queries below report their own failures
+            print(f"Warning: Failed to batch-query targets: {e}")
+        if not args.skip_build:
+            build_targets(args.targets)
+        print()
+
     packages = []
     for target in args.targets:
         try:
@@ -8,13 +8,34 @@ violation at once so they can be fixed in bulk.
 BXL graph tests cannot detect these because buck2 fails to parse the
 BUCK file before BXL can inspect it.
 
+Per-file results are cached in buck-out/verify_package_completeness.json
+keyed on (mtime, size), so warm runs only rescan BUCK files that changed.
+The cache is tagged with a hash of this script and dropped whenever the
+checker itself changes.
+
 Run:
     python3 tests/graph/verify_package_completeness.py
 """
 
+import hashlib
+import json
 import os
 import re
 import sys
+from pathlib import Path
+
+# One alternation pass per BUCK file instead of a separate regex scan
+# for each feature.  Group names record which features were seen.
+_SCAN_RE = re.compile(
+    rb'(?P<pkg>\bpackage\s*\()'
+    rb'|(?P<local_only>\blocal_only\s*=\s*True\b)'
+    rb'|(?P<shared_source>\bsource\s*=\s*"//[^"]+"\s*,)'
+    rb'|(?P<url>\burl\s*=)'
+    rb'|(?P<sha256>\bsha256\s*=)'
+)
+
+# Either of these exempts the file, so the scan can stop at the first one.
+_EXEMPT = frozenset({"local_only", "shared_source"})
 
 
 def find_project_root():
@@ -27,29 +48,47 @@ def find_project_root():
     return None
 
 
+def iter_buck_files(top):
+    """Yield DirEntry objects for BUCK files under top.
+
+    Symlinked directories are not followed, matching os.walk's default.
+    """
+    with os.scandir(top) as it:
+        subdirs = []
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name == "BUCK":
+                yield entry
+    for subdir in subdirs:
+        yield from iter_buck_files(subdir)
+
+
 def check_buck_file(path):
     """Return list of (issue, detail) for a BUCK file."""
-    with open(path) as f:
-        content = f.read()
+    content = Path(path).read_bytes()
 
-    # Only check files that use package() from package.bzl
-    if "package.bzl" not in content:
-        return []
-    if not re.search(r'\bpackage\s*\(', content):
+    # Only check files that use package() from package.bzl.  Most BUCK
+    # files don't load it at all; a plain substring test (memmem in C)
+    # rejects them without running the regex sweep.
+    if b"package.bzl" not in content:
         return []
 
-    # local_only packages don't need url/sha256
-    if re.search(r'\blocal_only\s*=\s*True\b', content):
-        return []
+    seen = set()
+    for m in _SCAN_RE.finditer(content):
+        if m.lastgroup in _EXEMPT:
+            # local_only packages don't need url/sha256.  Packages using a
+            # shared source target (source = "//...") get their archive
+            # from another BUCK target — no inline url/sha256 needed.
+            return []
+        seen.add(m.lastgroup)
 
-    # Packages using a shared source target (source = "//...") get their
-    # archive from another BUCK target — no inline url/sha256 needed.
-    if re.search(r'\bsource\s*=\s*"//[^"]+"\s*,', content):
+    if "pkg" not in seen:
         return []
 
     issues = []
-    has_url = re.search(r'\burl\s*=', content) is not None
-    has_sha = re.search(r'\bsha256\s*=', content) is not None
+    has_url = "url" in seen
+    has_sha = "sha256" in seen
 
     if not has_url:
         issues.append("missing url")
@@ -59,6 +98,39 @@ def check_buck_file(path):
     return issues
 
 
+def checker_version():
+    """Hash of this script, so cached verdicts die with the logic that made them."""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+def load_cache(path, version):
+    """Return the {relpath: [stat_key, issues]} cache, or {} if unusable.
+
+    A cache written by a different version of the checker is discarded.
+    """
+    try:
+        cache = json.loads(Path(path).read_bytes())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != version:
+        return {}
+    files = cache.get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def save_cache(path, version, cache):
+    """Write the cache back; a read-only tree just means no cache."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "files": cache}, f,
+                      separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
 def main():
     root = os.environ.get("PROJECT_ROOT") or find_project_root()
     if not root:
@@ -70,15 +142,29 @@ def main():
         print("ERROR: packages/ directory not found at {}".format(root))
         sys.exit(2)
 
-    violations = []
-    for dirpath, _dirs, files in os.walk(packages_dir):
-        if "BUCK" not in files:
-            continue
-        buck_path = os.path.join(dirpath, "BUCK")
-        rel_path = os.path.relpath(buck_path, root)
-        issues = check_buck_file(buck_path)
-        if issues:
-            violations.append((rel_path, issues))
+    cache_path = os.path.join(root, "buck-out", "verify_package_completeness.json")
+    version = checker_version()
+    old_cache = load_cache(cache_path, version)
+    cache = {}
+    stale = []
+    for entry in iter_buck_files(packages_dir):
+        rel = os.path.relpath(entry.path, root)
+        st = entry.stat()
+        key = "{}:{}".format(st.st_mtime_ns, st.st_size)
+        hit = old_cache.get(rel)
+        if hit and hit[0] == key:
+            cache[rel] = hit
+        else:
+            stale.append((rel, key, entry.path))
+
+    # Serial on purpose: nearly every file is rejected by the package.bzl
+    # substring test, so a process pool costs more to start than it saves.
+    for rel, key, path in stale:
+        cache[rel] = [key, check_buck_file(path)]
+    if stale or len(cache) != len(old_cache):
+        save_cache(cache_path, version, cache)
+
+    violations = [(rel, issues) for rel, (_, issues) in cache.items() if issues]
 
     violations.sort()
 
@@ -8,12 +8,13 @@ Stdlib only -- no pytest.
 import io
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 _REPO = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(_REPO / "tools"))
 
-from _env import clean_env, sanitize_global_env, _PASSTHROUGH, _DETERMINISM_PINS
+from _env import clean_env, sanitize_filenames, sanitize_global_env, _has_unsafe_chars, _PASSTHROUGH, _DETERMINISM_PINS
 
 passed = 0
 failed = 0
@@ -46,6 +47,7 @@ def main():
         os.environ["PATH"] = "/usr/bin"
         os.environ["CC"] = "gcc"
         os.environ["LDFLAGS"] = "-L/usr/lib"
+        clean_env.cache_clear()
         env = clean_env()
         allowed = _PASSTHROUGH | _DETERMINISM_PINS.keys() | {"CARGO_HOME"}
         extra = set(env.keys()) - allowed
@@ -62,6 +64,7 @@ def main():
     saved = dict(os.environ)
     try:
         os.environ["HOME"] = "/home/testuser"
+        clean_env.cache_clear()
         env = clean_env()
         if env.get("HOME") == "/home/testuser":
             ok("HOME preserved")
@@ -79,6 +82,7 @@ def main():
     saved = dict(os.environ)
     try:
         os.environ["PATH"] = "/usr/local/bin:/usr/bin"
+        clean_env.cache_clear()
         env = clean_env()
         if "PATH" not in env:
             ok("PATH not in clean_env result")
@@ -93,6 +97,7 @@ def main():
     saved = dict(os.environ)
     try:
         os.environ["BUCK_SCRATCH_PATH"] = "/tmp/buck-scratch"
+        clean_env.cache_clear()
         env = clean_env()
         if env.get("BUCK_SCRATCH_PATH") == "/tmp/buck-scratch":
             ok("BUCK_SCRATCH_PATH preserved")
@@ -108,6 +113,7 @@ def main():
     try:
         os.environ.clear()
         # Set nothing -- all passthrough vars absent
+        clean_env.cache_clear()
         env = clean_env()
         present_passthrough = set(env.keys()) & _PASSTHROUGH
         if not present_passthrough:
@@ -123,6 +129,7 @@ def main():
     saved = dict(os.environ)
     try:
         os.environ.clear()
+        clean_env.cache_clear()
         env = clean_env()
         missing = set(_DETERMINISM_PINS.keys()) - set(env.keys())
         if not missing:
@@ -137,6 +144,7 @@ def main():
     print("=== clean_env: LC_ALL ===")
     saved = dict(os.environ)
     try:
+        clean_env.cache_clear()
         env = clean_env()
         if env.get("LC_ALL") == "C":
             ok("LC_ALL is 'C'")
@@ -150,6 +158,7 @@ def main():
     print("=== clean_env: SOURCE_DATE_EPOCH ===")
     saved = dict(os.environ)
     try:
+        clean_env.cache_clear()
         env = clean_env()
         if env.get("SOURCE_DATE_EPOCH") == "315576000":
             ok("SOURCE_DATE_EPOCH is '315576000'")
@@ -163,6 +172,7 @@ def main():
     print("=== clean_env: CCACHE_DISABLE ===")
     saved = dict(os.environ)
     try:
+        clean_env.cache_clear()
         env = clean_env()
         if env.get("CCACHE_DISABLE") == "1":
             ok("CCACHE_DISABLE is '1'")
@@ -176,6 +186,7 @@ def main():
     print("=== clean_env: RUSTC_WRAPPER ===")
     saved = dict(os.environ)
     try:
+        clean_env.cache_clear()
         env = clean_env()
         if "RUSTC_WRAPPER" in env and env["RUSTC_WRAPPER"] == "":
             ok("RUSTC_WRAPPER is empty string")
@@ -196,6 +207,7 @@ def main():
         os.environ["PYTHONPATH"] = "/usr/lib/python"
         os.environ["LD_LIBRARY_PATH"] = "/usr/lib"
         os.environ["PKG_CONFIG_PATH"] = "/usr/lib/pkgconfig"
+        clean_env.cache_clear()
         env = clean_env()
         leaked = {"CC", "CXX", "LDFLAGS", "CFLAGS", "PYTHONPATH",
                   "LD_LIBRARY_PATH", "PKG_CONFIG_PATH"} & set(env.keys())
@@ -214,6 +226,7 @@ def main():
         os.environ["CC"] = "gcc"
         os.environ["HOME"] = "/home/test"
         before = dict(os.environ)
+        clean_env.cache_clear()
         clean_env()
         after = dict(os.environ)
         if before == after:
@@ -317,6 +330,7 @@ def main():
     try:
         os.environ["HOME"] = "/home/test"
         os.environ["CC"] = "gcc"
+        clean_env.cache_clear()
         r1 = clean_env()
         r2 = clean_env()
         if r1 == r2:
@@ -337,6 +351,7 @@ def main():
         os.environ["npm_config_cache"] = "/tmp/npm"
         os.environ["DISPLAY"] = ":0"
         os.environ["DBUS_SESSION_BUS_ADDRESS"] = "unix:path=/run/bus"
+        clean_env.cache_clear()
         env = clean_env()
         allowed = _PASSTHROUGH | _DETERMINISM_PINS.keys() | {"CARGO_HOME"}
         extra = set(env.keys()) - allowed
@@ -348,6 +363,71 @@ def main():
         os.environ.clear()
         os.environ.update(saved)
 
+    # -- clean_env: host vars snapshotted once, fresh dict per call --
+    print("=== clean_env: cached snapshot ===")
+    saved = dict(os.environ)
+    try:
+        os.environ["HOME"] = "/home/first"
+        clean_env.cache_clear()
+        r1 = clean_env()
+        r1["HOME"] = "/mutated"
+        os.environ["HOME"] = "/home/second"
+        r2 = clean_env()
+        if r2.get("HOME") == "/home/first":
+            ok("result cached until cache_clear()")
+        else:
+            fail(f"HOME: expected cached '/home/first', got '{r2.get('HOME')}'")
+        clean_env.cache_clear()
+        r3 = clean_env()
+        if r3.get("HOME") == "/home/second":
+            ok("cache_clear() picks up new host value")
+        else:
+            fail(f"HOME after cache_clear: got '{r3.get('HOME')}'")
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+        clean_env.cache_clear()
+
+    # -- _has_unsafe_chars: control chars, DEL and backslash --
+    print("=== _has_unsafe_chars ===")
+    for name, expected in [
+        ("conftest.c", False),
+        ("caf\u00e9~ -_.txt", False),
+        ("conftest.t\t", True),
+        ("a\nb", True),
+        ("\x00", True),
+        ("del\x7f", True),
+        ("back\\slash", True),
+        ("", False),
+    ]:
+        if _has_unsafe_chars(name) == expected:
+            ok(f"_has_unsafe_chars({name!r}) is {expected}")
+        else:
+            fail(f"_has_unsafe_chars({name!r}): expected {expected}")
+
+    # -- sanitize_filenames: removes unsafe entries at any depth --
+    print("=== sanitize_filenames: removes unsafe entries ===")
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "good", "nested"))
+        os.makedirs(os.path.join(root, "bad\\dir", "inner"))
+        for rel in ("keep.c", "conftest.t\t", "good/keep.h",
+                    "good/nested/x\x01y", "good/nested/keep.o",
+                    "bad\\dir/inner/file"):
+            Path(root, rel).write_text("")
+        os.symlink("good", os.path.join(root, "link\ttogood"))
+        sanitize_filenames(root)
+        remaining = sorted(
+            os.path.relpath(os.path.join(d, n), root)
+            for d, dirs, files in os.walk(root)
+            for n in dirs + files
+        )
+        expected = ["good", "good/keep.h", "good/nested",
+                    "good/nested/keep.o", "keep.c"]
+        if remaining == expected:
+            ok("only safe entries remain")
+        else:
+            fail(f"remaining entries: {remaining}")
+
     # -- BUCK: _env library has base_module="" (pex namespace regression) --
     # Without base_module="", Buck2 puts _env.py under the tools/ namespace
     # in the pex link-tree, so `from _env import ...` fails at runtime.
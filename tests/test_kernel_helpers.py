@@ -21,6 +21,11 @@ from kernel_config import _gcc14_workaround as config_gcc14_workaround
 # so we import it separately and test its subprocess-based behavior.
 from kernel_modules_install import _get_krelease as modules_get_krelease
 
+from kernel_headers import _input_digest as headers_input_digest
+from kernel_headers import _header_manifest as headers_manifest
+from kernel_headers import _existing_dirs as headers_existing_dirs
+from kernel_headers import _staged_config as headers_staged_config
+
 passed = 0
 failed = 0
 _output_lines = []
@@ -375,6 +380,168 @@ def main():
         else:
             fail(f"expected None, got {result!r}")
 
+    # ----------------------------------------------------------------
+    # kernel_headers._input_digest tests
+    # ----------------------------------------------------------------
+
+    print("=== headers_input_digest: tracks uapi headers, arch and config ===")
+    with tempfile.TemporaryDirectory() as src:
+        uapi = os.path.join(src, "include", "uapi", "linux")
+        os.makedirs(uapi)
+        with open(os.path.join(src, "Makefile"), "w") as f:
+            f.write("VERSION = 6\n")
+        with open(os.path.join(uapi, "types.h"), "w") as f:
+            f.write("#define A 1\n")
+        with open(os.path.join(src, "README"), "w") as f:
+            f.write("not a header input\n")
+        base = headers_input_digest(src, None, "x86", "")
+        if headers_input_digest(src, None, "x86", "") == base:
+            ok("digest is stable for unchanged inputs")
+        else:
+            fail("digest changed without input changes")
+        with open(os.path.join(src, "README"), "a") as f:
+            f.write("edit\n")
+        if headers_input_digest(src, None, "x86", "") == base:
+            ok("unrelated source files do not affect the digest")
+        else:
+            fail("README edit changed the digest")
+        os.makedirs(os.path.join(src, "scripts", "kconfig"))
+        with open(os.path.join(src, "scripts", "kconfig", "conf.c"), "w") as f:
+            f.write("int main(void) { return 0; }\n")
+        if headers_input_digest(src, None, "x86", "") == base:
+            ok("scripts/ subdirectories do not affect the digest")
+        else:
+            fail("scripts/kconfig edit changed the digest")
+        # What an in-tree build leaves behind in scripts/.
+        with open(os.path.join(src, "scripts", "unifdef"), "wb") as f:
+            f.write(b"\x7fELF")
+        with open(os.path.join(src, "scripts", ".unifdef.cmd"), "w") as f:
+            f.write("cmd_scripts/unifdef := cc -o scripts/unifdef\n")
+        if headers_input_digest(src, None, "x86", "") == base:
+            ok("in-tree build products in scripts/ do not affect the digest")
+        else:
+            fail("scripts/unifdef or .unifdef.cmd changed the digest")
+        with open(os.path.join(src, "scripts", "Makefile.headersinst"), "w") as f:
+            f.write("# install rules\n")
+        if headers_input_digest(src, None, "x86", "") != base:
+            ok("top-level scripts/ files are part of the digest")
+        else:
+            fail("scripts/Makefile.headersinst did not change the digest")
+        base = headers_input_digest(src, None, "x86", "")
+        if headers_input_digest(src, None, "arm64", "") != base:
+            ok("arch is part of the digest")
+        else:
+            fail("arch change did not change the digest")
+        syscalls = os.path.join(src, "arch", "arm64", "kernel")
+        os.makedirs(syscalls)
+        arm64 = headers_input_digest(src, None, "arm64", "")
+        with open(os.path.join(syscalls, "Makefile.syscalls"), "w") as f:
+            f.write("syscall_abis_64 += renameat rlimit memfd_secret\n")
+        if headers_input_digest(src, None, "arm64", "") != arm64:
+            ok("arch/$ARCH/kernel/Makefile.syscalls is part of the digest")
+        else:
+            fail("Makefile.syscalls edit did not change the digest")
+        config = os.path.join(src, ".config")
+        with open(config, "w") as f:
+            f.write("CONFIG_X=y\n")
+        if headers_input_digest(src, config, "x86", "") != base:
+            ok(".config is part of the digest")
+        else:
+            fail(".config did not change the digest")
+        with open(os.path.join(uapi, "types.h"), "w") as f:
+            f.write("#define A 2\n")
+        if headers_input_digest(src, None, "x86", "") != base:
+            ok("uapi header edit changes the digest")
+        else:
+            fail("uapi header edit did not change the digest")
+
+    print("=== headers_manifest: records each header's include closure ===")
+    with tempfile.TemporaryDirectory() as tree:
+        linux = os.path.join(tree, "include", "linux")
+        os.makedirs(linux)
+        os.makedirs(os.path.join(tree, "include", "asm"))
+        with open(os.path.join(linux, "bpf.h"), "w") as f:
+            f.write('#include <linux/types.h>\n#include "bpf_common.h"\n#include <stdint.h>\n')
+        with open(os.path.join(linux, "types.h"), "w") as f:
+            f.write("#include <asm/types.h>\n#include <linux/bpf.h>\n")
+        for name in ("linux/bpf_common.h", "asm/types.h", "linux/other.h"):
+            open(os.path.join(tree, "include", name), "w").close()
+        manifest = headers_manifest(tree)
+        expected = ["asm/types.h", "linux/bpf.h", "linux/bpf_common.h", "linux/types.h"]
+        if manifest.get("linux/bpf.h") == expected:
+            ok("closure follows <...> and \"...\" includes through cycles")
+        else:
+            fail(f"expected {expected}, got {manifest.get('linux/bpf.h')!r}")
+        if manifest.get("linux/other.h") == ["linux/other.h"]:
+            ok("header without includes maps to itself")
+        else:
+            fail(f"expected ['linux/other.h'], got {manifest.get('linux/other.h')!r}")
+
+    print("=== headers_existing_dirs: matches os.path.isdir, keeps order ===")
+    with tempfile.TemporaryDirectory() as d:
+        for sub in ("tc/bin", "tc/sbin", "solo"):
+            os.makedirs(os.path.join(d, sub))
+        open(os.path.join(d, "tc", "file"), "w").close()
+        os.symlink(os.path.join(d, "tc", "bin"), os.path.join(d, "tc", "link"))
+        paths = [os.path.join(d, p) for p in (
+            "tc/sbin", "tc/file", "missing/bin", "tc/bin", "tc/link", "tc/gone", "solo")]
+        expected = [p for p in paths if os.path.isdir(p)]
+        result = headers_existing_dirs(paths)
+        if result == expected:
+            ok("grouped scandir agrees with per-path isdir")
+        else:
+            fail(f"expected {expected}, got {result!r}")
+
+    print("=== headers_staged_config: sets aside and restores source .config ===")
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "src")
+        os.makedirs(src)
+        config = os.path.join(d, "build.config")
+        with open(config, "w") as f:
+            f.write("CONFIG_BUILD=y\n")
+        dot_config = os.path.join(src, ".config")
+        saved = dot_config + ".buckos-saved"
+
+        def _read(path):
+            with open(path) as f:
+                return f.read()
+
+        with open(dot_config, "w") as f:
+            f.write("CONFIG_USER=y\n")
+        with headers_staged_config(src, config):
+            staged = _read(dot_config)
+        if staged == "CONFIG_BUILD=y\n":
+            ok("build config is staged as .config inside the block")
+        else:
+            fail(f"expected build config staged, got {staged!r}")
+        if _read(dot_config) == "CONFIG_USER=y\n" and not os.path.lexists(saved):
+            ok("existing .config is restored after success")
+        else:
+            fail("existing .config was not restored after success")
+
+        try:
+            with headers_staged_config(src, config):
+                raise RuntimeError("make died")
+        except RuntimeError:
+            pass
+        if _read(dot_config) == "CONFIG_USER=y\n" and not os.path.lexists(saved):
+            ok("existing .config is restored after an exception")
+        else:
+            fail("existing .config was not restored after an exception")
+
+        # An interrupted run leaves its staged config as .config and the
+        # user's original aside.
+        with open(dot_config, "w") as f:
+            f.write("CONFIG_BUILD=y\n")
+        with open(saved, "w") as f:
+            f.write("CONFIG_USER=y\n")
+        with headers_staged_config(src, config):
+            pass
+        if _read(dot_config) == "CONFIG_USER=y\n" and not os.path.lexists(saved):
+            ok("leftover .buckos-saved is recovered, not overwritten")
+        else:
+            fail("leftover .buckos-saved was lost or not recovered")
+
     # -- Summary --
     sys.stdout = _real_stdout
     if failed:
@@ -13,6 +13,7 @@ Env vars from sh_test:
     RUN_ENV   — optional path to runtime env wrapper (sets LD_LIBRARY_PATH)
 """
 
+import collections
 import ctypes
 import os
 import re
@@ -29,14 +30,43 @@ def _pdeathsig():
 _CLEAR_RE = re.compile(r"\x1bc|\x1b\[[0-9]*[JH]|\x1b\[\?[0-9;]*[hl]")
 
 
-def find_file(base, name):
-    """Find a named file under base, or return base if it's a file."""
+def _iter_files(base):
+    """Yield DirEntry objects for non-directories under base, top-down.
+
+    Visits entries in os.walk order and does not descend into symlinked
+    directories.
+    """
+    try:
+        it = os.scandir(base)
+    except OSError:
+        return
+    subdirs = []
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            else:
+                yield entry
+    for subdir in subdirs:
+        yield from _iter_files(subdir)
+
+
+def find_file(base, name, exts=()):
+    """Find a named file under base, or return base if it's a file.
+
+    Stops at the first file called *name*.  If none exists, falls back
+    to the first file ending in one of *exts*, found in the same pass.
+    """
     if os.path.isfile(base):
         return base
-    for dirpath, _, filenames in os.walk(base):
-        if name in filenames:
-            return os.path.join(dirpath, name)
-    return None
+    fallback = None
+    for entry in _iter_files(base):
+        if entry.name == name:
+            return entry.path
+        if fallback is None and entry.name.endswith(exts):
+            fallback = entry.path
+    return fallback
 
 
 def find_kernel(path):
@@ -89,21 +119,10 @@ def main():
         sys.exit(1)
 
     # Resolve ISO
-    iso_file = find_file(iso, "buckos.iso")
-    if not iso_file:
-        for dirpath, _, filenames in os.walk(iso):
-            for f in filenames:
-                if f.endswith(".iso"):
-                    iso_file = os.path.join(dirpath, f)
-                    break
-            if iso_file:
-                break
+    iso_file = find_file(iso, "buckos.iso", exts=(".iso",))
     if not iso_file:
-        if os.path.isfile(iso):
-            iso_file = iso
-        else:
-            print(f"FAIL: no .iso found in {iso}")
-            sys.exit(1)
+        print(f"FAIL: no .iso found in {iso}")
+        sys.exit(1)
 
     # Resolve QEMU binary (arch-aware)
     import platform
@@ -144,7 +163,8 @@ def main():
         "shell": "System initialization complete.",
     }
     found = set()
-    lines = []
+    # Only the tail is ever printed, so don't hold the whole serial log.
+    lines = collections.deque(maxlen=200)
 
     proc = subprocess.Popen(
         cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
@@ -165,9 +185,9 @@ def main():
         for line in proc.stdout:
             lines.append(line)
             for label, marker in markers.items():
-                if marker in line and label not in found:
+                if label not in found and marker in line:
                     found.add(label)
-            if found == set(markers.keys()):
+            if len(found) == len(markers):
                 _kill_pg()
                 break
     finally:
@@ -177,7 +197,7 @@ def main():
 
     output = "".join(lines)
     output = _CLEAR_RE.sub("", output)
-    ok = found == set(markers.keys())
+    ok = len(found) == len(markers)
 
     if ok:
         tail = "\n".join(output.splitlines()[-10:])
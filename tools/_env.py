@@ -11,7 +11,9 @@ what it needs on top.
 """
 
 import atexit
+import functools
 import os
+import re
 import signal
 import shutil
 import sys
@@ -66,11 +68,12 @@ _DETERMINISM_PINS = {
 }
 
 
-def clean_env():
-    """Return a clean env dict for subprocess env= parameter.
+@functools.lru_cache(maxsize=1)
+def _clean_env_items():
+    """Snapshot the host passthrough vars and build the clean env once.
 
-    Copies only whitelisted vars from the host, then applies
-    determinism pins.  Callers layer helper-specific vars on top.
+    Returned as a tuple of (key, value) pairs so the cached result cannot
+    be mutated by callers; clean_env() hands each caller a fresh dict.
     """
     env = {}
     for key in _PASSTHROUGH:
@@ -86,6 +89,20 @@ def clean_env():
     # isolation (mozbuild_helper) set RUSTUP_HOME themselves.
     scratch = env.get("BUCK_SCRATCH_PATH") or env.get("TMPDIR") or "/tmp"
     env["CARGO_HOME"] = os.path.join(scratch, "buckos-cargo-home")
+    return tuple(env.items())
+
+
+def clean_env():
+    """Return a clean env dict for subprocess env= parameter.
+
+    Copies only whitelisted vars from the host, then applies
+    determinism pins.  Callers layer helper-specific vars on top.
+
+    The host vars are read once per process (some helpers call this
+    per subprocess).  Call clean_env.cache_clear() after changing a
+    whitelisted var in os.environ to pick up the new value.
+    """
+    env = dict(_clean_env_items())
     # Disable posix_spawn in the current process — buckos-built
     # binaries have padded ELF interpreters that cause ENOEXEC/ENOTCONN.
     # Child processes get it via sysroot_lib_paths or explicit calls.
@@ -95,6 +112,9 @@ def clean_env():
     return env
 
 
+clean_env.cache_clear = _clean_env_items.cache_clear
+
+
 def apply_cache_config(env):
     """Override determinism pins based on BUCKOS_CCACHE/BUCKOS_SCCACHE env vars.
 
@@ -171,9 +191,14 @@ def setup_ccache_symlinks(env, scratch_dir):
     return ccache_dir
 
 
+# Control chars, DEL and backslash.  Matched in C by the regex engine
+# rather than a per-character Python loop over every filename.
+_UNSAFE_NAME_RE = re.compile(r"[\x00-\x1f\x7f\\]")
+
+
 def _has_unsafe_chars(name):
     """True if *name* contains characters Buck2 cannot relativize."""
-    return any(ord(c) < 32 or ord(c) == 127 or c == "\\" for c in name)
+    return _UNSAFE_NAME_RE.search(name) is not None
 
 
 def sanitize_filenames(*roots):
@@ -181,24 +206,37 @@ def sanitize_filenames(*roots):
 
     Some build systems (autoconf's filesystem character test, conftest.t<TAB>)
     create files that Buck2's path handling cannot relativize.  Walk each
-    root bottom-up and remove offending entries before Buck2 sees them.
+    root and remove offending entries before Buck2 sees them.
     """
     for root in roots:
         if not root or not os.path.isdir(root):
             continue
-        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
-            for fname in filenames:
-                if _has_unsafe_chars(fname):
-                    try:
-                        os.unlink(os.path.join(dirpath, fname))
-                    except OSError:
-                        pass
-            for dname in list(dirnames):
-                if _has_unsafe_chars(dname):
-                    try:
-                        shutil.rmtree(os.path.join(dirpath, dname))
-                    except OSError:
-                        pass
+        _sanitize_dir(root)
+
+
+def _sanitize_dir(path):
+    """Remove entries with unsafe names under path, recursively.
+
+    An offending directory is removed whole rather than descended into;
+    symlinks are unlinked, never followed.
+    """
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            unsafe = _has_unsafe_chars(entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if unsafe:
+                        shutil.rmtree(entry.path)
+                    else:
+                        _sanitize_dir(entry.path)
+                elif unsafe:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
 
 
 # ── Guaranteed cleanup ────────────────────────────────────────────────
@@ -939,6 +977,7 @@ def sanitize_global_env():
     os.environ.clear()
     os.environ.update(keep)
     os.environ.update(_DETERMINISM_PINS)
+    clean_env.cache_clear()
     import subprocess as _subprocess
 
     _subprocess._USE_POSIX_SPAWN = False
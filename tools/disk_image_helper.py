@@ -16,10 +16,27 @@ import tempfile
 from _env import add_path_args, clean_env, setup_path
 
 
-def _run(cmd, env, **kwargs):
-    """Run a subprocess with clean env, exiting on failure."""
-    result = subprocess.run(cmd, env=env, **kwargs)
+def _run(cmd, env, quiet=False, **kwargs):
+    """Run a subprocess with clean env, exiting on failure.
+
+    With quiet=True, stdout and stderr go to an anonymous temp file
+    instead of being buffered in memory, and are only read back and
+    printed if the command fails.
+    """
+    output = b""
+    if not quiet:
+        result = subprocess.run(cmd, env=env, **kwargs)
+    else:
+        # The child needs a real fd, so a SpooledTemporaryFile would roll
+        # over to disk immediately anyway — use a plain TemporaryFile.
+        with tempfile.TemporaryFile() as log:
+            result = subprocess.run(cmd, env=env, stdout=log,
+                                    stderr=subprocess.STDOUT, **kwargs)
+            if result.returncode != 0:
+                log.seek(0)
+                output = log.read()
     if result.returncode != 0:
+        sys.stderr.write(output.decode(errors="replace"))
         print(f"error: {cmd[0]} failed with exit code {result.returncode}", file=sys.stderr)
         sys.exit(1)
 
@@ -113,8 +130,7 @@ def _apply_ima(image, rootfs, filesystem, env):
         cmds_file = f.name
 
     try:
-        _run(["debugfs", "-w", "-f", cmds_file, image], env,
-             capture_output=True)
+        _run(["debugfs", "-w", "-f", cmds_file, image], env, quiet=True)
     finally:
         os.unlink(cmds_file)
 
@@ -217,10 +233,10 @@ def main():
             # Write partition images into the GPT disk image
             _run(["dd", f"if={efi_img}", f"of={output}",
                   "bs=512", f"seek={efi_part['start']}",
-                  "conv=notrunc"], env, capture_output=True)
+                  "conv=notrunc"], env, quiet=True)
             _run(["dd", f"if={root_img}", f"of={output}",
                   "bs=512", f"seek={root_part['start']}",
-                  "conv=notrunc"], env, capture_output=True)
+                  "conv=notrunc"], env, quiet=True)
         finally:
             # Clean up temp files
             for f in os.listdir(tmpdir):
@@ -67,7 +67,18 @@ def main():
     )
     find_proc.stdout.close()
 
-    cpio_data, _ = cpio_proc.communicate()
+    # Stream cpio output straight into the gzip writer through one reused
+    # buffer rather than holding the whole uncompressed archive in memory.
+    buf = bytearray(1 << 20)
+    view = memoryview(buf)
+    with gzip.GzipFile(args.output, "wb", mtime=epoch) as f:
+        while True:
+            n = cpio_proc.stdout.readinto(buf)
+            if not n:
+                break
+            f.write(view[:n])
+    cpio_proc.stdout.close()
+    cpio_proc.wait()
     find_proc.wait()
 
     if find_proc.returncode != 0:
@@ -77,10 +88,6 @@ def main():
         print(f"error: cpio exited with code {cpio_proc.returncode}", file=sys.stderr)
         sys.exit(1)
 
-    epoch = int(os.environ.get("SOURCE_DATE_EPOCH", "315576000"))
-    with gzip.GzipFile(args.output, "wb", mtime=epoch) as f:
-        f.write(cpio_data)
-
     size_kb = os.path.getsize(args.output) // 1024
     print(f"initramfs: {args.output} ({size_kb}K)")
 
@@ -3,17 +3,368 @@
 
 Produces a clean headers tree suitable for glibc/musl/BPF compilation.
 Uses O=<build-dir> to keep the kernel source tree read-only.
+
+Installed trees are cached under buck-out/buckos-cache/kernel-headers,
+keyed on a digest of everything headers_install reads, so a rebuild
+with unchanged inputs copies the cached tree instead of running make.
+Buck does not track that cache: a hit is only as sound as the digest.
+Entries are copied, never hardlinked, so the declared output shares no
+inode with it.  Use --no-cache for a fully hermetic run.
 """
 
 import argparse
+import contextlib
+import filecmp
+import fnmatch
+import hashlib
+import json
 import os
+import re
 import shutil
 import subprocess
 import sys
+import tempfile
 
 from _env import sanitize_global_env, sysroot_lib_paths
 
 
+# Inputs of headers_install relative to the source tree; "{arch}" is the
+# ARCH= value.  Missing entries are skipped (layouts vary by version).
+# Directories are hashed recursively.
+_DIGEST_INPUTS = (
+    "Makefile",
+    "include/uapi",
+    "usr/include/Makefile",
+    "arch/{arch}/Makefile",
+    "arch/{arch}/include/uapi",
+    "arch/{arch}/entry/syscalls",
+    "arch/{arch}/kernel/syscalls",
+    "arch/{arch}/kernel/Makefile.syscalls",
+)
+
+# Top-level source files here are hashed too (not subdirectories): this
+# covers Makefile.headersinst, Makefile.asm-headers (Makefile.asm-generic
+# before 6.11), syscallhdr.sh, syscalltbl.sh, syscall.tbl,
+# headers_install.sh, unifdef.c and whatever later kernels add.  Only
+# source names match, so an in-tree build's scripts/unifdef binary and
+# .*.cmd files don't change the digest.
+_DIGEST_SCRIPTS_DIR = "scripts"
+_DIGEST_SCRIPTS_PATTERNS = ("*.sh", "*.c", "*.tbl", "Makefile.*", "Kbuild.include")
+
+# Cache entries kept; the least recently used beyond this are removed.
+_CACHE_ENTRIES = 8
+
+
+def _hash_path(h, top, rel, patterns=None):
+    """Feed a file, or every file under a directory, into h in sorted order.
+
+    With patterns, only the directory's top-level files whose names match
+    one of them are hashed.
+    """
+    path = os.path.join(top, rel)
+    if os.path.isdir(path) and patterns:
+        with os.scandir(path) as it:
+            names = sorted(
+                e.path for e in it
+                if not e.name.startswith(".") and e.is_file()
+                and any(fnmatch.fnmatchcase(e.name, p) for p in patterns))
+    elif os.path.isdir(path):
+        names = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            names.extend(os.path.join(dirpath, f) for f in sorted(filenames))
+    elif os.path.isfile(path):
+        names = [path]
+    else:
+        return
+    for name in names:
+        h.update(os.path.relpath(name, top).encode() + b"\0")
+        with open(name, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+
+
+def _input_digest(source_dir, config_file, arch, cross_compile):
+    """Return a hex digest of every input that shapes the installed headers."""
+    h = hashlib.sha256()
+    h.update(f"arch={arch}\0cross={cross_compile}\0".encode())
+    if config_file:
+        h.update(b"config\0")
+        _hash_path(h, os.path.dirname(config_file), os.path.basename(config_file))
+    for rel in _DIGEST_INPUTS:
+        _hash_path(h, source_dir, rel.format(arch=arch))
+    _hash_path(h, source_dir, _DIGEST_SCRIPTS_DIR, patterns=_DIGEST_SCRIPTS_PATTERNS)
+    return h.hexdigest()
+
+
+_INCLUDE_RE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"]+)[>"]', re.M)
+
+# Per-entry map of each installed header to its #include closure.
+_MANIFEST = ".buckos_manifest.json"
+
+
+def _header_manifest(tree):
+    """Map every header under tree/include to its #include closure.
+
+    Paths are relative to tree/include, as they appear in #include <...>.
+    Includes that resolve outside the tree (libc headers) are dropped.
+    """
+    include_dir = os.path.join(tree, "include")
+    deps = {}
+    for dirpath, _, filenames in os.walk(include_dir):
+        rel_dir = os.path.relpath(dirpath, include_dir)
+        for name in filenames:
+            rel = os.path.normpath(os.path.join(rel_dir, name))
+            with open(os.path.join(dirpath, name), "rb") as f:
+                found = _INCLUDE_RE.findall(f.read())
+            incs = deps[rel] = []
+            for delim, inc in found:
+                inc = inc.decode()
+                if delim == b'"':
+                    # "quoted" includes may also resolve next to the includer.
+                    incs.append(os.path.normpath(os.path.join(rel_dir, inc)))
+                incs.append(inc)
+
+    manifest = {}
+    for root in deps:
+        seen = {root}
+        stack = [root]
+        while stack:
+            for dep in deps[stack.pop()]:
+                if dep in deps and dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        manifest[root] = sorted(seen)
+    return manifest
+
+
+def _copy_headers(entry, output_dir, headers):
+    """Copy only the requested headers and their closure out of a cache entry.
+
+    Returns False, copying nothing, if the entry has no manifest or any
+    requested header is not in it.  Otherwise output_dir/include is
+    emptied first, so headers from another kernel can't be mixed in.
+    """
+    try:
+        with open(os.path.join(entry, _MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not all(h in manifest for h in headers):
+        return False
+    closure = set()
+    for h in headers:
+        closure.update(manifest[h])
+    shutil.rmtree(os.path.join(output_dir, "include"), ignore_errors=True)
+    for rel in sorted(closure):
+        dst = os.path.join(output_dir, "include", rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(os.path.join(entry, "include", rel), dst)
+    os.utime(entry)
+    return True
+
+
+def _copy_tree(src, dst, ignore=None):
+    """Copy every file under src into dst."""
+    shutil.copytree(src, dst, symlinks=True, ignore=ignore, dirs_exist_ok=True)
+
+
+def _cache_store(output_dir, entry):
+    """Publish output_dir as cache entry; a broken cache never fails the build."""
+    tmp = f"{entry}.tmp.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        _copy_tree(output_dir, tmp)
+        with open(os.path.join(tmp, _MANIFEST), "w") as f:
+            json.dump(_header_manifest(tmp), f, separators=(",", ":"))
+        os.rename(tmp, entry)
+    except OSError:
+        # Lost a race with another writer, or the cache is unwritable.
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    _cache_evict(os.path.dirname(entry))
+
+
+def _cache_evict(cache_dir):
+    """Remove all but the _CACHE_ENTRIES most recently used entries."""
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [(e.stat().st_mtime, e.path) for e in it
+                       if e.is_dir(follow_symlinks=False) and ".tmp." not in e.name]
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    for _, path in entries[_CACHE_ENTRIES:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _discard(path):
+    """Remove a directory tree without waiting for it.
+
+    The rename is O(1) and frees the name immediately; unlinking tens of
+    thousands of Kbuild objects happens in a detached child process.
+    """
+    try:
+        trash = tempfile.mkdtemp(prefix=os.path.basename(path) + ".trash.",
+                                 dir=os.path.dirname(path))
+        os.rename(path, os.path.join(trash, "tree"))
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    try:
+        subprocess.Popen(
+            [sys.executable, "-c", "import shutil, sys; shutil.rmtree(sys.argv[1], True)", trash],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+    except OSError:
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+def _place_config(config_file, dot_config):
+    """Put config_file at dot_config, by hardlink, symlink or copy.
+
+    Kconfig replaces .config by rename when it rewrites it, so the
+    source file is never modified through the link.
+    """
+    try:
+        os.link(config_file, dot_config)
+    except OSError:
+        try:
+            os.symlink(config_file, dot_config)
+        except OSError:
+            shutil.copy2(config_file, dot_config)
+
+
+@contextlib.contextmanager
+def _staged_config(source_dir, config_file):
+    """Place config_file as source_dir/.config for the duration of the block.
+
+    Any .config already there is set aside and put back afterwards,
+    whatever happens in between.  A no-op when config_file is None.
+    """
+    if not config_file:
+        yield
+        return
+    dot_config = os.path.join(source_dir, ".config")
+    saved_config = dot_config + ".buckos-saved"
+    if os.path.lexists(saved_config):
+        # A previous run died before restoring: the .config there now is
+        # its staged build config, and the user's original is the saved one.
+        print(f"Restoring {dot_config} left aside by an interrupted run")
+        os.replace(saved_config, dot_config)
+    had_config = os.path.lexists(dot_config)
+    try:
+        if had_config:
+            os.replace(dot_config, saved_config)
+        _place_config(config_file, dot_config)
+        yield
+    finally:
+        try:
+            os.unlink(dot_config)
+        except FileNotFoundError:
+            pass
+        if had_config:
+            os.replace(saved_config, dot_config)
+
+
+def _existing_dirs(paths):
+    """Return the entries of paths that are directories, in order.
+
+    Paths sharing a parent (e.g. $TC/bin and $TC/sbin) are checked
+    against one listing of that parent.
+    """
+    by_parent = {}
+    for path in paths:
+        by_parent.setdefault(os.path.dirname(path), []).append(path)
+    found = set()
+    for parent, children in by_parent.items():
+        if len(children) == 1:
+            if os.path.isdir(children[0]):
+                found.add(children[0])
+            continue
+        try:
+            with os.scandir(parent) as it:
+                names = {e.name for e in it if e.is_dir()}
+        except OSError:
+            continue
+        found.update(c for c in children if os.path.basename(c) in names)
+    return [p for p in paths if p in found]
+
+
+def _write_digest(digest_file, digest):
+    """Record the input digest of a complete headers tree beside it."""
+    with open(digest_file, "w") as f:
+        f.write(digest + "\n")
+
+
+def _prepare_build_dir(build_dir, config_file, stamp):
+    """Reuse build_dir when it was last built from the same inputs.
+
+    Kbuild's own dependency tracking then skips the fixdep/unifdef host
+    tools and unchanged headers.  A different ARCH, CROSS_COMPILE, HOSTCC
+    or .config invalidates the tree, since Kbuild would not notice those.
+    """
+    stamp_file = os.path.join(build_dir, ".buckos_stamp")
+    dot_config = os.path.join(build_dir, ".config")
+    if config_file:
+        # .config may be a link to config_file, in which case an in-place
+        # edit of the source changes both sides of the filecmp below.
+        with open(config_file, "rb") as f:
+            stamp = dict(stamp, config=hashlib.sha256(f.read()).hexdigest())
+    try:
+        with open(stamp_file) as f:
+            reusable = json.load(f) == stamp
+    except (OSError, ValueError):
+        reusable = False
+    if reusable:
+        if config_file:
+            reusable = (os.path.isfile(dot_config)
+                        and filecmp.cmp(config_file, dot_config, shallow=False))
+        else:
+            reusable = not os.path.exists(dot_config)
+
+    if not reusable:
+        if os.path.exists(build_dir):
+            _discard(build_dir)
+        os.makedirs(build_dir)
+        if config_file:
+            _place_config(config_file, dot_config)
+        with open(stamp_file, "w") as f:
+            json.dump(stamp, f)
+
+
+def _pump(src):
+    """Copy a buffered binary stream to stdout in 64 KiB blocks until EOF.
+
+    BufferedReader.read(n) keeps reading until it has n bytes or hits
+    EOF, so Kbuild's one-line-per-header output reaches stdout as a few
+    large writes rather than one write per line.
+    """
+    while True:
+        chunk = src.read(65536)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(1, view):]
+
+
+def _run(cmd, env):
+    """Run cmd to completion and return its exit code.
+
+    stdout and stderr are merged and relayed through _pump.  This goes
+    through subprocess (fork+exec) like every other helper:
+    sanitize_global_env() turns posix_spawn off because buckos binaries
+    with padded ELF interpreters fail to exec through it.
+    """
+    sys.stdout.flush()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    with proc.stdout:
+        _pump(proc.stdout)
+    return proc.wait()
+
+
 def main():
     parser = argparse.ArgumentParser(description="Install kernel headers")
     parser.add_argument("--source-dir", required=True,
@@ -36,12 +387,72 @@ def main():
                         help="Buckos ld-linux path (disables posix_spawn)")
     parser.add_argument("--path-prepend", action="append", dest="path_prepend", default=[],
                         help="Directory to prepend to PATH (repeatable, resolved to absolute)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Installed-headers cache (default: buck-out/buckos-cache/kernel-headers)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always run headers_install, bypassing the cache")
+    parser.add_argument("--need-header", action="append", dest="need_headers", default=[],
+                        help="Only install this header (e.g. linux/bpf.h) and what it "
+                             "includes, when the cache has it (repeatable)")
+    parser.add_argument("--in-tree", action="store_true",
+                        help="Build in the source tree without O= (for throwaway "
+                             "checkouts); .config there is restored afterwards")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Run make -s, dropping Kbuild's per-header log lines")
+    parser.add_argument("--clean", action="store_true",
+                        help="Remove the O= build directory after installing")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Parallel jobs (default: CPU count)")
     args = parser.parse_args()
 
+    cache_dir = args.cache_dir or os.path.join("buck-out", "buckos-cache", "kernel-headers")
     _host_path = os.environ.get("PATH", "")
     _cc_val = os.environ.get("CC", "")
+    # Resolve relative paths against one getcwd() rather than calling
+    # os.path.abspath (a getcwd() syscall each) per argument.
     _project_root = os.getcwd()
+
+    # kernel.bzl passes project-relative buck-out/... paths; join them onto
+    # the cwd read above (absolute paths pass through join() unchanged).
+    source_dir = os.path.normpath(os.path.join(_project_root, args.source_dir))
+    config_file = (os.path.normpath(os.path.join(_project_root, args.config))
+                   if args.config else None)
+    output_dir = os.path.normpath(os.path.join(_project_root, args.output_dir))
+
+    if not os.path.isdir(source_dir):
+        print(f"error: source directory not found: {source_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    if config_file and not os.path.isfile(config_file):
+        print(f"error: config file not found: {config_file}", file=sys.stderr)
+        sys.exit(1)
+
+    # A previous run outside Buck (which deletes declared outputs first)
+    # may have left an identical tree in output_dir.  The stamp sits next
+    # to it, like .kbuild, so the installed artifact holds only headers.
+    digest_file = output_dir + ".digest"
+    digest = None
+    if not args.no_cache:
+        digest = _input_digest(source_dir, config_file, args.arch, args.cross_compile)
+        try:
+            with open(digest_file) as f:
+                up_to_date = f.read().strip() == digest
+        except OSError:
+            up_to_date = False
+        if up_to_date and os.path.isfile(
+                os.path.join(output_dir, "include", "linux", "version.h")):
+            print(f"Kernel headers in {output_dir} are up to date")
+            return
+        # Whatever happens next, the old stamp no longer describes the tree.
+        try:
+            os.unlink(digest_file)
+        except FileNotFoundError:
+            pass
+
     sanitize_global_env()
+    # Everything below configures make's environment; build it up here and
+    # hand it to the child rather than mutating os.environ.
+    child_env = dict(os.environ)
     # Resolve CC paths to absolute (relative buck-out paths break after make -C)
     if _cc_val:
         _resolved_parts = []
@@ -57,80 +468,100 @@ def main():
                     _tok = os.path.join(_project_root, _tok)
             _resolved_parts.append(_tok)
         _cc_val = " ".join(_resolved_parts)
-        os.environ["CC"] = _cc_val
+        child_env["CC"] = _cc_val
 
     # Apply PATH from toolchain flags
     if args.hermetic_path:
-        _hp_dirs = [os.path.abspath(p) for p in args.hermetic_path]
+        _hp_dirs = [os.path.normpath(os.path.join(_project_root, p))
+                    for p in args.hermetic_path]
         if args.ld_linux:
             from portabilize import portabilize_toolchain
             _patchelf = shutil.which("patchelf", path=":".join(_hp_dirs))
             _hp_dirs = portabilize_toolchain(
                 _hp_dirs, args.ld_linux, patchelf_path=_patchelf)
-        os.environ["PATH"] = ":".join(_hp_dirs)
+        child_env["PATH"] = ":".join(_hp_dirs)
     elif args.hermetic_empty:
-        os.environ["PATH"] = ""
+        child_env["PATH"] = ""
     elif args.allow_host_path:
-        os.environ["PATH"] = _host_path
+        child_env["PATH"] = _host_path
     else:
         print("error: kernel_headers requires --hermetic-path, --hermetic-empty, or --allow-host-path",
               file=sys.stderr)
         sys.exit(1)
     if args.path_prepend:
-        _pp_dirs = [os.path.abspath(p) for p in args.path_prepend if os.path.isdir(p)]
+        _pp_dirs = _existing_dirs([os.path.normpath(os.path.join(_project_root, p))
+                                   for p in args.path_prepend])
         if args.ld_linux and _pp_dirs:
             from portabilize import portabilize_toolchain
             _pp_dirs = portabilize_toolchain(_pp_dirs, args.ld_linux)
         if _pp_dirs:
-            os.environ["PATH"] = ":".join(_pp_dirs) + ":" + os.environ.get("PATH", "")
+            child_env["PATH"] = ":".join(_pp_dirs) + ":" + child_env.get("PATH", "")
 
     if args.ld_linux:
-        sysroot_lib_paths(args.ld_linux, os.environ)
+        sysroot_lib_paths(args.ld_linux, child_env)
 
     # Portabilize CC so HOSTCC uses the patched binary
     if args.ld_linux and _cc_val:
         from portabilize import portabilize_toolchain
-        _cc_bin = os.path.abspath(_cc_val.split()[0])
+        _cc_bin = os.path.normpath(os.path.join(_project_root, _cc_val.split()[0]))
         if os.path.isfile(_cc_bin):
             _cc_dir = os.path.dirname(_cc_bin)
-            _patchelf = shutil.which("patchelf", path=os.environ.get("PATH", ""))
+            _patchelf = shutil.which("patchelf", path=child_env.get("PATH", ""))
             _port_dirs = portabilize_toolchain(
                 [_cc_dir], args.ld_linux, patchelf_path=_patchelf)
             if _port_dirs:
                 _parts = _cc_val.split()
                 _parts[0] = os.path.join(_port_dirs[0], os.path.basename(_cc_bin))
                 _cc_val = " ".join(_parts)
-                os.environ["CC"] = _cc_val
+                child_env["CC"] = _cc_val
 
-    source_dir = os.path.abspath(args.source_dir)
-    config_file = os.path.abspath(args.config) if args.config else None
-    output_dir = os.path.abspath(args.output_dir)
+    cache_entry = None
+    if digest:
+        cache_entry = os.path.join(_project_root, cache_dir, digest)
+        if args.need_headers and _copy_headers(cache_entry, output_dir, args.need_headers):
+            print(f"Copied {len(args.need_headers)} cached kernel header(s) "
+                  f"{digest[:12]} and their includes to {output_dir}")
+            return
+        if os.path.isdir(cache_entry):
+            print(f"Copying cached kernel headers {digest[:12]} to {output_dir}")
+            shutil.rmtree(os.path.join(output_dir, "include"), ignore_errors=True)
+            _copy_tree(cache_entry, output_dir,
+                       ignore=lambda d, names: [_MANIFEST] if d == cache_entry else [])
+            os.utime(cache_entry)
+            _write_digest(digest_file, digest)
+            print("Kernel headers installed successfully")
+            return
 
-    if not os.path.isdir(source_dir):
-        print(f"error: source directory not found: {source_dir}", file=sys.stderr)
-        sys.exit(1)
-
-    if config_file and not os.path.isfile(config_file):
-        print(f"error: config file not found: {config_file}", file=sys.stderr)
-        sys.exit(1)
-
-    # Create a temporary build directory for O= builds
-    build_dir = output_dir + ".kbuild"
-    if os.path.exists(build_dir):
-        shutil.rmtree(build_dir)
-    os.makedirs(build_dir)
-
-    # Copy .config into the O= build directory (if provided)
-    if config_file:
-        shutil.copy2(config_file, os.path.join(build_dir, ".config"))
+    # In-tree builds skip the O= shadow tree (and its second Kconfig
+    # parse); their .config is staged in source_dir right before make.
+    if args.in_tree:
+        build_dir = None
+    else:
+        # Build directory for O= builds, kept between runs for incremental
+        # rebuilds unless its inputs changed.
+        build_dir = output_dir + ".kbuild"
+        _prepare_build_dir(build_dir, config_file, {
+            "arch": args.arch,
+            "cross_compile": args.cross_compile,
+            "cc": child_env.get("CC", ""),
+        })
 
     # Ensure output dir exists
     os.makedirs(output_dir, exist_ok=True)
 
-    # Build make command
+    # Build make command.  -l keeps parallel make from oversubscribing a
+    # host that is already busy with other actions; --output-sync keeps
+    # each directory's output together.
+    jobs = args.jobs or os.cpu_count() or 1
     make_cmd = [
-        "make", "-C", source_dir,
-        f"O={build_dir}",
+        "make", f"-j{jobs}", f"-l{jobs + 1}", "--output-sync=target",
+        "-C", source_dir,
+    ]
+    if args.quiet:
+        make_cmd.insert(1, "-s")
+    if build_dir:
+        make_cmd.append(f"O={build_dir}")
+    make_cmd += [
         f"ARCH={args.arch}",
         f"INSTALL_HDR_PATH={output_dir}",
         "headers_install",
@@ -139,7 +570,7 @@ def main():
         make_cmd.append(f"CROSS_COMPILE={args.cross_compile}")
     # Pass HOSTCC and flags so make uses buckos compiler for fixdep.
     # Split multi-token CC into HOSTCC (binary) + HOSTCFLAGS (flags).
-    _cc_val = os.environ.get("CC", "")
+    _cc_val = child_env.get("CC", "")
     if _cc_val:
         _parts = _cc_val.split()
         make_cmd.append(f"HOSTCC={_parts[0]}")
@@ -148,14 +579,21 @@ def main():
 
     print(f"Installing kernel headers to {output_dir}")
     print(f"  + {' '.join(make_cmd)}")
-    result = subprocess.run(make_cmd)
-    if result.returncode != 0:
-        print(f"error: headers_install failed with exit code {result.returncode}",
+    staged = (_staged_config(source_dir, config_file) if args.in_tree
+              else contextlib.nullcontext())
+    with staged:
+        returncode = _run(make_cmd, child_env)
+    if returncode != 0:
+        print(f"error: headers_install failed with exit code {returncode}",
               file=sys.stderr)
         sys.exit(1)
 
-    # Clean up temporary build dir
-    shutil.rmtree(build_dir, ignore_errors=True)
+    if args.clean and build_dir:
+        _discard(build_dir)
+
+    if cache_entry:
+        _cache_store(output_dir, cache_entry)
+        _write_digest(digest_file, digest)
 
     print("Kernel headers installed successfully")
 